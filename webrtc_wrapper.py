@@ -1,23 +1,240 @@
 import asyncio
+import collections
 import websockets
-import matplotlib.pyplot as plt
 import logging
-import json
+import multiprocessing
+import orjson
+import os
 import signal
 import platform
+import subprocess
+import threading
+import time
+from multiprocessing import shared_memory
+from queue import Empty, Full
+import av
 import cv2
-from aiortc import RTCPeerConnection, RTCSessionDescription, MediaStreamError
+import numpy as np
+from aiortc import RTCPeerConnection, RTCRtpReceiver, RTCSessionDescription, MediaStreamError
+from aiortc.codecs import h264
 from aiortc.contrib.media import MediaPlayer
+from aiortc.mediastreams import VIDEO_TIME_BASE
+
+# Use uvloop's faster event loop for all asyncio work when it is installed
+try:
+    import uvloop
+    uvloop.install()
+except ImportError:
+    pass
 
 # Configure logging to display informational messages
 logging.basicConfig(level=logging.INFO)
 
+# websockets options shared by the signaling server and its clients: ping to detect dead
+# connections in bounded time, and skip permessage-deflate on the small signaling messages
+SIGNALING_OPTIONS = {"ping_interval": 20, "ping_timeout": 10, "compression": None}
+
+# DRM render node used by the h264_vaapi encoder
+VAAPI_DEVICE = "/dev/dri/renderD128"
+
+# H.264 encoders tried in order when saving received video, hardware encoders first.
+# Each entry is (encoder name, extra ffmpeg input options, extra ffmpeg output options).
+# Output is 4:2:0 so players can open it; ffmpeg would otherwise keep 4:4:4 for BGR input.
+VIDEO_ENCODERS = [
+    ("h264_nvenc", [], ["-preset", "p1", "-pix_fmt", "yuv420p"]),
+    ("h264_vaapi", ["-vaapi_device", VAAPI_DEVICE], ["-vf", "format=nv12,hwupload"]),
+    ("h264_amf", [], ["-pix_fmt", "yuv420p"]),
+    ("libx264", [], ["-preset", "ultrafast", "-pix_fmt", "yuv420p"]),
+    ("mpeg4", [], ["-q:v", "5", "-pix_fmt", "yuv420p"]),
+]
+
+# Frames allowed to wait in a received track's queue before the display starts skipping frames
+MAX_DISPLAY_BACKLOG = 2
+# Longest time in seconds between displayed frames, even while skipping
+MAX_DISPLAY_INTERVAL = 1 / 30
+# How often in seconds the display process services its window while waiting for frames
+DISPLAY_POLL_INTERVAL = 0.03
+# Size of the display's shared frame buffer: one 4K BGR frame. Larger frames are scaled down.
+MAX_DISPLAY_FRAME_BYTES = 3840 * 2160 * 3
+# Seconds to wait for the display process to exit; a newly spawned one first has to
+# finish importing this module
+DISPLAY_STOP_TIMEOUT = 5
+
+# Hardware H.264 decoders tried in order when hardware decoding is enabled on the receiver
+HW_DECODERS = ["h264_cuvid", "h264_qsv", "h264_v4l2m2m"]
+
+# Start the display process with "spawn" on every OS: forking the receiver, which already
+# runs decoder, worker and OpenCV threads, can deadlock the child
+DISPLAY_CONTEXT = multiprocessing.get_context("spawn")
+
+# OpenCV conversions for YUV layouts that PyAV exports as one (height * 3/2, width) array
+YUV_TO_BGR = {"yuv420p": cv2.COLOR_YUV2BGR_I420, "nv12": cv2.COLOR_YUV2BGR_NV12}
+
+def enable_hw_decode():
+    """
+    Make aiortc decode received H.264 with the first hardware decoder that can be opened.
+
+    This patches aiortc's H264Decoder for the whole process. Opening a decoder does not
+    prove its device is present, so a decoder switches back to software decoding if the
+    hardware fails before it has produced any frame. VP8 streams, and H.264 streams on
+    machines without a usable hardware decoder, keep being decoded in software.
+
+    Returns:
+        str or None: Name of the hardware decoder tried first, or None if none is available.
+    """
+    for name in HW_DECODERS:
+        try:
+            # Rules out decoders missing from the FFmpeg build; the device is checked on decode
+            av.CodecContext.create(name, "r").open()
+        except (ValueError, av.error.FFmpegError):
+            continue
+
+        def __init__(decoder):
+            decoder.codec = av.CodecContext.create(name, "r")
+            # Set once the hardware decoder has produced a frame
+            decoder.hw_verified = False
+
+        def decode(decoder, encoded_frame):
+            packet = av.Packet(encoded_frame.data)
+            packet.pts = encoded_frame.timestamp
+            packet.time_base = VIDEO_TIME_BASE
+            try:
+                frames = decoder.codec.decode(packet)
+            except av.error.FFmpegError as e:
+                if decoder.hw_verified or decoder.codec.name == "h264":
+                    logging.warning(f"H.264 decoding failed, skipping packet: {e}")
+                    return []
+                # The hardware isn't usable here; decode this packet and the rest in software
+                logging.warning(f"{decoder.codec.name} failed to decode, using software decoding: {e}")
+                decoder.codec = av.CodecContext.create("h264", "r")
+                return decode(decoder, encoded_frame)
+            if frames:
+                decoder.hw_verified = True
+            return frames
+
+        h264.H264Decoder.__init__ = __init__
+        h264.H264Decoder.decode = decode
+        logging.info(f"Decoding received H.264 with {name}")
+        return name
+
+    logging.warning("No hardware H.264 decoder available, using software decoding")
+    return None
+
+def run_display(shm_name, lock, ready, quit_requested, stop_requested):
+    """
+    Show the frames written to shared memory in an OpenCV window. Runs in the
+    display process started by VideoDisplay.
+
+    Args:
+        shm_name (str): Name of the shared memory block holding the current BGR frame.
+        lock (multiprocessing.Lock): Held while the frame is being written or shown.
+        ready (multiprocessing.Queue): Receives the shape of each new frame.
+        quit_requested (multiprocessing.Event): Set when 'q' is pressed in the window.
+        stop_requested (multiprocessing.Event): Set by the receiver to close the window.
+    """
+    shm = shared_memory.SharedMemory(name=shm_name)
+    try:
+        while not stop_requested.is_set():
+            # Time out regularly so the window stays responsive while no frames arrive
+            try:
+                shape = ready.get(timeout=DISPLAY_POLL_INTERVAL)
+                with lock:
+                    cv2.imshow("receiver", np.ndarray(shape, np.uint8, buffer=shm.buf))
+            except Empty:
+                pass
+            if cv2.waitKey(1) & 0xFF == ord("q"):
+                quit_requested.set()
+                break
+    finally:
+        cv2.destroyAllWindows()
+        shm.close()
+
+class VideoDisplay:
+    """
+    An OpenCV display window running in a separate process, so drawing frames does not
+    compete with the receiver's asyncio loop for the GIL. Frames of any size up to
+    MAX_DISPLAY_FRAME_BYTES are passed through one shared memory block, so the process
+    keeps running when the stream's resolution changes.
+    """
+    def __init__(self):
+        """
+        Allocate the shared frame buffer and start the display process.
+        """
+        self.shm = shared_memory.SharedMemory(create=True, size=MAX_DISPLAY_FRAME_BYTES)
+        self.closed = False
+        self.lock = DISPLAY_CONTEXT.Lock()
+        # Holds at most one pending frame; when it is full the display is still busy
+        self.ready = DISPLAY_CONTEXT.Queue(maxsize=1)
+        self.quit_requested = DISPLAY_CONTEXT.Event()
+        self.stop_requested = DISPLAY_CONTEXT.Event()
+        self.process = DISPLAY_CONTEXT.Process(
+            target=run_display,
+            args=(self.shm.name, self.lock, self.ready, self.quit_requested, self.stop_requested),
+            daemon=True
+        )
+        self.process.start()
+
+    def show(self, img):
+        """
+        Hand a frame to the display process, skipping it if the display is still busy.
+
+        Args:
+            img (numpy.ndarray): BGR frame to display.
+
+        Returns:
+            bool: Whether the frame was handed to the display; always False once closed.
+        """
+        # Frames still queued on the track can arrive after the display was closed
+        if self.closed:
+            return False
+        if self.ready.full() or not self.lock.acquire(block=False):
+            return False
+        try:
+            if img.nbytes > MAX_DISPLAY_FRAME_BYTES:
+                scale = (MAX_DISPLAY_FRAME_BYTES / img.nbytes) ** 0.5
+                size = (int(img.shape[1] * scale), int(img.shape[0] * scale))
+                img = cv2.resize(img, size, interpolation=cv2.INTER_AREA)
+            np.copyto(np.ndarray(img.shape, np.uint8, buffer=self.shm.buf), img)
+        finally:
+            self.lock.release()
+        try:
+            self.ready.put_nowait(img.shape)
+        except Full:
+            return False
+        return True
+
+    def close(self):
+        """
+        Ask the display process to stop, without blocking the caller (usually the
+        event loop). Safe to call more than once.
+        """
+        if self.closed:
+            return
+        self.closed = True
+        self.stop_requested.set()
+        # Joining can take a few seconds, so reap the process and free the memory on a thread
+        threading.Thread(target=self.join_process, daemon=True).start()
+
+    def join_process(self):
+        """
+        Wait for the display process to exit, terminating it if it does not stop in time,
+        then free the shared memory.
+        """
+        self.process.join(timeout=DISPLAY_STOP_TIMEOUT)
+        if self.process.is_alive():
+            self.process.terminate()
+            self.process.join()
+        # Only unlink once the display process is gone, so it can never find the block missing
+        self.shm.close()
+        self.shm.unlink()
+
 class WebRTCWrapper:
     """
     A class to handle WebRTC video streaming with signaling over WebSockets.
     Supports sending and receiving video streams, with optional video saving.
     """
-    def __init__(self, signaling_server_url="ws://localhost:8765", port=8765, source=None, save_output=False):
+    def __init__(self, signaling_server_url="ws://localhost:8765", port=8765, source=None, save_output=False,
+                 hw_decode=False):
         """
         Initialize the WebRTCWrapper.
 
@@ -26,15 +243,19 @@ class WebRTCWrapper:
             port (int): Port for the signaling server.
             source (str or int): Video source (e.g., camera device or file path).
             save_output (bool): Whether to save received video to a file.
+            hw_decode (bool): Whether the receiver decodes H.264 with a hardware decoder when available.
         """
         self.signaling_server_url = signaling_server_url
         self.port = port
         self.source = source or self.get_default_source()
         self.save_output = save_output
+        self.hw_decode = hw_decode
         # Dictionary to store WebSocket connections for sender and receiver
         self.clients = {"sender": None, "receiver": None}
         # Queues to store messages when the target client is not connected
-        self.message_queue = {"sender": [], "receiver": []}
+        self.message_queue = {"sender": collections.deque(), "receiver": collections.deque()}
+        # Outgoing queues of connected clients, drained by a dedicated writer task each
+        self.out_queues = {"sender": None, "receiver": None}
         self.sender_task = None
 
     def get_default_source(self):
@@ -57,11 +278,154 @@ class WebRTCWrapper:
         else:
             raise RuntimeError("Unsupported OS")
 
+    def parse_signaling_message(self, message):
+        """
+        Decode a signaling message, unpacking batches of messages that the signaling
+        server queued while this client was not connected.
+
+        Args:
+            message (str or bytes): JSON message received from the signaling server.
+
+        Returns:
+            list: Decoded messages, oldest first.
+        """
+        data = orjson.loads(message)
+        return data["batch"] if "batch" in data else [data]
+
+    def get_video_encoder(self):
+        """
+        Select the first encoder from VIDEO_ENCODERS that the installed ffmpeg supports
+        and that can actually encode on this machine.
+
+        Returns:
+            tuple or None: Entry of VIDEO_ENCODERS, or None if ffmpeg is unavailable.
+        """
+        try:
+            result = subprocess.run(
+                ["ffmpeg", "-hide_banner", "-encoders"],
+                capture_output=True, text=True, check=True
+            )
+        except (OSError, subprocess.CalledProcessError) as e:
+            logging.error(f"ffmpeg is not available, received video will not be saved: {e}")
+            return None
+
+        # Encoder listing lines look like " V....D h264_nvenc  NVIDIA NVENC H.264 encoder"
+        available = {line.split()[1] for line in result.stdout.splitlines() if len(line.split()) > 1}
+        for encoder in VIDEO_ENCODERS:
+            name, input_args, output_args = encoder
+            if name not in available:
+                continue
+            if name == "h264_vaapi" and not os.path.exists(VAAPI_DEVICE):
+                continue
+            # ffmpeg lists the encoders it was built with, even without the hardware behind
+            # them, so encode a short test clip to check the encoder really works
+            try:
+                probe = subprocess.run(
+                    ["ffmpeg", "-hide_banner", "-loglevel", "error", *input_args,
+                     "-f", "lavfi", "-i", "nullsrc=s=256x256:d=0.1",
+                     *output_args, "-c:v", name, "-f", "null", "-"],
+                    capture_output=True, timeout=10
+                )
+            except subprocess.TimeoutExpired:
+                logging.info(f"{name} test encode timed out, trying the next encoder")
+                continue
+            if probe.returncode != 0:
+                logging.info(f"{name} is not usable on this machine, trying the next encoder")
+                continue
+            logging.info(f"Saving received video with {name}")
+            return encoder
+        logging.error("No supported H.264/MPEG-4 encoder found, received video will not be saved")
+        return None
+
+    def open_video_writer(self, encoder, width, height, pix_fmt="bgr24"):
+        """
+        Start an ffmpeg process that encodes raw frames from its stdin to
+        received_output.mp4.
+
+        Args:
+            encoder (tuple): Entry of VIDEO_ENCODERS to encode with.
+            width (int): Frame width in pixels.
+            height (int): Frame height in pixels.
+            pix_fmt (str): Pixel format of the raw frames, "bgr24" or "yuv420p".
+
+        Returns:
+            subprocess.Popen: The ffmpeg process.
+        """
+        name, input_args, output_args = encoder
+        command = [
+            "ffmpeg", "-y", "-loglevel", "error", *input_args,
+            "-f", "rawvideo", "-pix_fmt", pix_fmt, "-s", f"{width}x{height}", "-r", "20", "-i", "-",
+            *output_args, "-c:v", name, "received_output.mp4"
+        ]
+        # A 1 MiB stdin buffer coalesces small frames into fewer, larger pipe writes
+        return subprocess.Popen(command, stdin=subprocess.PIPE, bufsize=1 << 20)
+
+    def close_video_writer(self, video_writer):
+        """
+        Flush the remaining frames to ffmpeg and wait for it to finalize the file.
+
+        Args:
+            video_writer (subprocess.Popen): ffmpeg process from open_video_writer.
+        """
+        try:
+            # Closing stdin flushes buffered frames and signals end of input to ffmpeg
+            video_writer.stdin.close()
+        except BrokenPipeError:
+            logging.error("ffmpeg exited before all frames were written")
+        video_writer.wait()
+
+    def frame_to_bgr(self, frame, out=None, yuv=None):
+        """
+        Convert a decoded video frame to a BGR image.
+
+        I420 (yuv420p) frames, as produced by aiortc's decoders, and NV12 frames from
+        hardware decoders are converted by OpenCV directly into the given buffer so no
+        new image is allocated per frame.
+        Other pixel formats fall back to PyAV's own conversion. The result is always
+        C-contiguous so it can be handed to ffmpeg without another copy.
+
+        Args:
+            frame (av.VideoFrame): The decoded video frame.
+            out (numpy.ndarray): Optional (height, width, 3) buffer to reuse.
+            yuv (numpy.ndarray): frame.to_ndarray() of a YUV frame, if already computed.
+
+        Returns:
+            numpy.ndarray: The BGR image, which is `out` whenever it could be reused.
+        """
+        if frame.format.name not in YUV_TO_BGR or frame.width % 2 or frame.height % 2:
+            # PyAV may return a strided view of a padded frame; this is a no-op otherwise
+            return np.ascontiguousarray(frame.to_ndarray(format="bgr24"))
+        if out is None or out.shape != (frame.height, frame.width, 3):
+            out = np.empty((frame.height, frame.width, 3), np.uint8)
+        if yuv is None:
+            yuv = frame.to_ndarray()
+        cv2.cvtColor(yuv, YUV_TO_BGR[frame.format.name], dst=out)
+        return out
+
     async def start_signaling_server(self):
         """
         Start a WebSocket signaling server to exchange SDP and ICE candidates
         between sender and receiver.
         """
+        async def forward_messages(websocket, out_queue, unsent):
+            """
+            Send queued messages to a client, so a slow peer never stalls the
+            receive loop of the client forwarding to it.
+
+            Args:
+                websocket: WebSocket connection object.
+                out_queue (asyncio.Queue): Messages to send to the client.
+                unsent (collections.deque): Receives the message being sent if the
+                    writer is cancelled or the connection closes mid-send.
+            """
+            while True:
+                message = await out_queue.get()
+                try:
+                    await websocket.send(message)
+                except (asyncio.CancelledError, websockets.exceptions.ConnectionClosed):
+                    unsent.append(message)
+                    raise
+
         async def handler(websocket):
             """
             Handle WebSocket connections for signaling.
@@ -69,6 +433,7 @@ class WebRTCWrapper:
             Args:
                 websocket: WebSocket connection object.
             """
+            writer = None
             try:
                 # Receive the role (sender or receiver) from the client
                 role = await websocket.recv()
@@ -81,20 +446,44 @@ class WebRTCWrapper:
 
                 # Store the WebSocket connection for the role
                 self.clients[role] = websocket
-
-                # Send any queued messages for this role
-                while self.message_queue[role]:
-                    await websocket.send(self.message_queue[role].pop(0))
+                # Determine the target role (opposite of the current role)
+                target = "receiver" if role == "sender" else "sender"
+
+                # Send any queued messages for this role, batched into a single message if there are several
+                # Messages only leave the queue once sent, so a disconnect mid-send keeps them
+                queue = self.message_queue[role]
+                if len(queue) > 1:
+                    batched = list(queue)
+                    try:
+                        payload = orjson.dumps({"batch": [orjson.loads(m) for m in batched]})
+                    except orjson.JSONDecodeError:
+                        logging.warning(f"Non-JSON message queued for {role} — sending queue unbatched")
+                    else:
+                        await websocket.send(payload)
+                        # More messages may have been queued while sending; keep those
+                        for _ in batched:
+                            queue.popleft()
+                while queue:
+                    await websocket.send(queue[0])
+                    queue.popleft()
+
+                # Start the writer task that sends messages forwarded to this role
+                out_queue = asyncio.Queue(maxsize=64)
+                unsent = collections.deque()
+                self.out_queues[role] = out_queue
+                writer = asyncio.create_task(forward_messages(websocket, out_queue, unsent))
 
                 # Continuously receive and forward messages
                 while True:
                     message = await websocket.recv()
-                    # Determine the target role (opposite of the current role)
-                    target = "receiver" if role == "sender" else "sender"
-                    target_ws = self.clients.get(target)
-                    if target_ws:
-                        # Forward the message to the target
-                        await target_ws.send(message)
+                    # Look the peer up per message, since it may reconnect at any time
+                    target_queue = self.out_queues[target]
+                    if target_queue:
+                        # Hand the message to the target's writer, dropping the oldest if it is backed up
+                        if target_queue.full():
+                            logging.warning(f"{target} is not keeping up — dropping oldest message")
+                            target_queue.get_nowait()
+                        target_queue.put_nowait(message)
                     else:
                         # Queue the message if the target is not connected
                         logging.warning(f"{target} not connected — queueing message")
@@ -103,10 +492,33 @@ class WebRTCWrapper:
             except websockets.exceptions.ConnectionClosed:
                 # Handle client disconnection
                 logging.info(f"{role} disconnected")
-                self.clients[role] = None
-
-        # Start the WebSocket server
-        async with websockets.serve(handler, "0.0.0.0", self.port):
+                # The client may already have reconnected on a new socket
+                if self.clients[role] is websocket:
+                    self.clients[role] = None
+            finally:
+                if writer:
+                    writer.cancel()
+                    # Wait for the writer so its exception, if a send failed, is retrieved
+                    await asyncio.gather(writer, return_exceptions=True)
+                    unsent.extend(out_queue.get_nowait() for _ in range(out_queue.qsize()))
+
+                    # Only clear the outgoing queue if a reconnect hasn't replaced it yet
+                    current_queue = self.out_queues[role]
+                    if current_queue is out_queue:
+                        self.out_queues[role] = current_queue = None
+                    if current_queue is None:
+                        # Keep unsent messages for delivery when the client reconnects
+                        self.message_queue[role].extend(unsent)
+                    else:
+                        # The client already reconnected, so hand them to its new connection
+                        for message in unsent:
+                            if current_queue.full():
+                                logging.warning(f"{role} is not keeping up — dropping oldest message")
+                                current_queue.get_nowait()
+                            current_queue.put_nowait(message)
+
+        # Start the WebSocket server. Signaling messages are small SDP blobs, so cap their size.
+        async with websockets.serve(handler, "0.0.0.0", self.port, max_size=2**16, **SIGNALING_OPTIONS):
             logging.info(f"Signaling server running on ws://0.0.0.0:{self.port}")
             await asyncio.Future()  # Keep the server running indefinitely
 
@@ -136,13 +548,24 @@ class WebRTCWrapper:
         offer = await pc.createOffer()
         await pc.setLocalDescription(offer)
 
+        # Set once the ICE connection is closed, by either side or by the track ending
+        closed = asyncio.Event()
+
+        @pc.on("iceconnectionstatechange")
+        def on_iceconnectionstatechange():
+            """
+            Handle changes in ICE connection state.
+            """
+            if pc.iceConnectionState == "closed":
+                closed.set()
+
         try:
             # Connect to the signaling server
-            async with websockets.connect(self.signaling_server_url) as websocket:
+            async with websockets.connect(self.signaling_server_url, **SIGNALING_OPTIONS) as websocket:
                 # Identify as the sender
                 await websocket.send("sender")
-                # Send the offer SDP
-                await websocket.send(json.dumps({
+                # Send the offer SDP as a binary frame, which skips UTF-8 validation
+                await websocket.send(orjson.dumps({
                     "type": pc.localDescription.type,
                     "sdp": pc.localDescription.sdp
                 }))
@@ -154,20 +577,25 @@ class WebRTCWrapper:
                     logging.error("Timeout waiting for answer SDP")
                     return
 
-                # Set the remote answer SDP
-                data = json.loads(message)
+                # Set the remote answer SDP, using the latest one if several were queued
+                data = self.parse_signaling_message(message)[-1]
                 answer = RTCSessionDescription(sdp=data["sdp"], type=data["type"])
                 await pc.setRemoteDescription(answer)
 
                 # Monitor the video track to detect when it ends
                 if player.video:
+                    # Set from the track's "ended" event, emitted when a stored video reaches its end
+                    track_ended = asyncio.Event()
+                    video_track.on("ended", track_ended.set)
+                    if video_track.readyState != "live":
+                        track_ended.set()
+
                     async def monitor_video_track():
                         """
                         Monitor the video track and close the connection when it ends.
                         """
                         try:
-                            while video_track.readyState == "live":
-                                await asyncio.sleep(0.1)  # Check frequently
+                            await track_ended.wait()
                             logging.info("Video track ended, closing connection")
                             await pc.close()
                         except Exception as e:
@@ -177,8 +605,7 @@ class WebRTCWrapper:
                     asyncio.ensure_future(monitor_video_track())
 
                 # Keep the connection alive until closed
-                while pc.iceConnectionState != "closed":
-                    await asyncio.sleep(1)
+                await closed.wait()
         except Exception as e:
             logging.error(f"Sender connection error: {e}")
         finally:
@@ -191,14 +618,28 @@ class WebRTCWrapper:
         Run the receiver side of the WebRTC connection, which displays and optionally
         saves the received video stream.
         """
+        # Cache the running loop for the synchronous callbacks below
+        loop = asyncio.get_running_loop()
+        if self.hw_decode:
+            enable_hw_decode()
         # Create a new RTCPeerConnection
         pc = RTCPeerConnection()
-        # Initialize matplotlib for real-time video display
-        plt.ion()
-        fig, ax = plt.subplots()
-        img_display = None
-
+        if self.hw_decode:
+            # aiortc offers VP8 before H.264 and the answer keeps the offer's order, so put
+            # H.264 first on the video transceiver the offer will be matched to; otherwise
+            # the hardware H.264 decoder would never be used
+            transceiver = pc.addTransceiver("video", direction="recvonly")
+            codecs = RTCRtpReceiver.getCapabilities("video").codecs
+            transceiver.setCodecPreferences(sorted(codecs, key=lambda c: c.mimeType.lower() != "video/h264"))
+        # Set once the ICE connection is closed
+        closed = asyncio.Event()
+        # Probe ffmpeg once up front so the first frame isn't delayed by it
+        encoder = self.get_video_encoder() if self.save_output else None
         video_writer = None
+        # Display process, started once the first frame's size is known
+        display = None
+        # Task running display_video, awaited on shutdown so saving can finish
+        display_task = None
 
         @pc.on("track")
         def on_track(track):
@@ -208,71 +649,137 @@ class WebRTCWrapper:
             Args:
                 track: The received media track (video or audio).
             """
+            nonlocal display_task
             logging.info(f"Receiving {track.kind} track")
 
             if track.kind == "video":
+                async def write_frames(write_q):
+                    """
+                    Pipe queued frames to ffmpeg on a worker thread so encoding and disk
+                    I/O never block the event loop. A None item stops the worker.
+
+                    Args:
+                        write_q (asyncio.Queue): Queue of raw frames to save, in the writer's pixel format.
+                    """
+                    nonlocal encoder, video_writer
+                    while True:
+                        img = await write_q.get()
+                        if img is None:
+                            break
+                        if video_writer is None:
+                            continue
+                        try:
+                            # Write the array's buffer directly instead of copying it with tobytes()
+                            await asyncio.to_thread(video_writer.stdin.write, img.data)
+                        except BrokenPipeError:
+                            # Keep displaying the stream even if the encoder died, but reap the process
+                            logging.error("ffmpeg exited unexpectedly, stopped saving video")
+                            await asyncio.to_thread(self.close_video_writer, video_writer)
+                            encoder, video_writer = None, None
+
+                    if video_writer:
+                        await asyncio.to_thread(self.close_video_writer, video_writer)
+
                 async def display_video():
                     """
                     Display the received video frames in real-time and optionally save them.
+                    Press 'q' in the display window to close it.
                     """
-                    nonlocal img_display, video_writer
+                    nonlocal video_writer, display
+                    # BGR buffer reused across frames of the same size
+                    bgr_buf = None
+                    video_size = None
+                    save_yuv = False
+                    last_shown = 0.0
+                    # Start the display process now, so it has loaded by the time frames arrive
+                    display = VideoDisplay()
+                    # Bounded so a slow encoder drops frames instead of buffering without limit
+                    write_q = asyncio.Queue(maxsize=8)
+                    writer_task = asyncio.ensure_future(write_frames(write_q)) if encoder else None
                     try:
                         while True:
                             # Receive a video frame
                             frame = await track.recv()
-                            img = frame.to_ndarray(format="bgr24")
-                            rgb_img = img[..., ::-1]  # Convert BGR to RGB for display
-
-                            # Initialize video writer if saving is enabled
-                            if self.save_output and video_writer is None:
-                                height, width = img.shape[:2]
-                                video_writer = cv2.VideoWriter(
-                                    "received_output.avi",
-                                    cv2.VideoWriter_fourcc(*"XVID"),
-                                    20,
-                                    (width, height)
+                            if display.quit_requested.is_set():
+                                logging.info("'q' pressed, closing window")
+                                break
+
+                            # Skip stale frames when the display falls behind, so only the freshest
+                            # ones are shown, but still show one at least every MAX_DISPLAY_INTERVAL
+                            backlog = track._queue.qsize() if hasattr(track, "_queue") else 0
+                            show = (backlog <= MAX_DISPLAY_BACKLOG
+                                    or time.monotonic() - last_shown >= MAX_DISPLAY_INTERVAL)
+                            # Frames skipped for display are still handed to the writer when saving;
+                            # only a full writer queue drops frames from the file
+                            if not show and not encoder:
+                                continue
+
+                            # Start the ffmpeg encoder if saving is enabled
+                            if encoder and video_writer is None:
+                                # I420 frames are piped as-is, which skips the BGR conversion
+                                # and sends half the data (12 instead of 24 bits per pixel)
+                                save_yuv = (frame.format.name == "yuv420p"
+                                            and not (frame.width % 2 or frame.height % 2))
+                                video_size = (frame.height, frame.width)
+                                video_writer = self.open_video_writer(
+                                    encoder, frame.width, frame.height, "yuv420p" if save_yuv else "bgr24"
                                 )
 
-                            # Write frame to video file if saving
-                            if self.save_output and video_writer:
-                                video_writer.write(img)
-
-                            # Display the frame
-                            if img_display is None:
-                                img_display = ax.imshow(rgb_img)
-                            else:
-                                img_display.set_data(rgb_img)
-                            plt.draw()
-                            plt.pause(0.001)
+                            # Pipe the frame to ffmpeg if saving; raw video can't change size mid-stream
+                            img = yuv = None
+                            if video_writer and (frame.height, frame.width) == video_size:
+                                if write_q.full():
+                                    logging.warning("Video writer falling behind, dropping frame")
+                                elif save_yuv:
+                                    if frame.format.name != "yuv420p":
+                                        frame = frame.reformat(format="yuv420p")
+                                    # to_ndarray() packs the planes into a new array, so no copy is needed
+                                    yuv = frame.to_ndarray()
+                                    write_q.put_nowait(yuv)
+                                else:
+                                    img = bgr_buf = self.frame_to_bgr(frame, bgr_buf)
+                                    # img is overwritten by the next frame, so queue a copy of it
+                                    write_q.put_nowait(img.copy())
+
+                            if not show:
+                                continue
+                            # Only convert to BGR for display
+                            if img is None:
+                                img = bgr_buf = self.frame_to_bgr(frame, bgr_buf, yuv)
+
+                            # Display the frame in the display process
+                            if display.show(img):
+                                last_shown = time.monotonic()
                     except MediaStreamError:
                         # Handle stream termination
                         logging.warning("Stream ended or connection closed")
+                    finally:
+                        # Close the connection and release display and writer resources,
+                        # whatever ended the loop
                         await pc.close()
-                        plt.close(fig)
-                        if video_writer:
-                            video_writer.release()
+                        if display:
+                            display.close()
+                        if writer_task and not writer_task.done():
+                            # Let the worker save the frames still queued, then close ffmpeg. Stop
+                            # waiting to enqueue if it dies first, since nothing would drain the queue.
+                            stop = asyncio.ensure_future(write_q.put(None))
+                            await asyncio.wait([stop, writer_task], return_when=asyncio.FIRST_COMPLETED)
+                            if stop.done():
+                                await asyncio.wait([writer_task])
+                            else:
+                                stop.cancel()
+                        if writer_task and not writer_task.cancelled() and writer_task.exception():
+                            # The worker died without closing ffmpeg, so reap it here
+                            logging.error(f"Video writer failed: {writer_task.exception()}")
+                            if video_writer:
+                                await asyncio.to_thread(self.close_video_writer, video_writer)
 
                 # Start the video display coroutine
-                asyncio.ensure_future(display_video())
-
-        def on_key(event):
-            """
-            Handle key press events to close the display window.
-
-            Args:
-                event: Matplotlib key press event.
-            """
-            if event.key == "q":
-                logging.info("'q' pressed, closing window")
-                plt.close(fig)
-                asyncio.create_task(pc.close())
-
-        # Connect the key press event handler
-        fig.canvas.mpl_connect("key_press_event", on_key)
+                display_task = asyncio.ensure_future(display_video())
 
         try:
             # Connect to the signaling server
-            async with websockets.connect(self.signaling_server_url) as websocket:
+            async with websockets.connect(self.signaling_server_url, **SIGNALING_OPTIONS) as websocket:
                 # Identify as the receiver
                 await websocket.send("receiver")
                 logging.info("Connected to signaling server")
@@ -284,15 +791,15 @@ class WebRTCWrapper:
                     logging.error("Timeout waiting for offer SDP")
                     return
 
-                # Set the remote offer SDP
-                data = json.loads(message)
+                # Set the remote offer SDP, using the latest one if several were queued
+                data = self.parse_signaling_message(message)[-1]
                 offer = RTCSessionDescription(sdp=data["sdp"], type=data["type"])
                 await pc.setRemoteDescription(offer)
 
-                # Create and send the answer SDP
+                # Create and send the answer SDP as a binary frame, which skips UTF-8 validation
                 answer = await pc.createAnswer()
                 await pc.setLocalDescription(answer)
-                await websocket.send(json.dumps({
+                await websocket.send(orjson.dumps({
                     "type": pc.localDescription.type,
                     "sdp": pc.localDescription.sdp
                 }))
@@ -304,11 +811,16 @@ class WebRTCWrapper:
                     """
                     if pc.iceConnectionState == "closed":
                         logging.warning("Connection closed by peer")
-                        plt.close(fig)
-                        asyncio.create_task(pc.close())
+                        if display:
+                            display.close()
+                        loop.call_soon_threadsafe(lambda: asyncio.create_task(pc.close()))
+                        closed.set()
 
                 # Set the ICE connection state change handler
                 pc.on("iceconnectionstatechange", on_iceconnectionstatechange)
+                # The connection may already have closed while the answer was being sent
+                if pc.iceConnectionState == "closed":
+                    closed.set()
 
                 def signal_handler(sig, frame):
                     """
@@ -319,23 +831,30 @@ class WebRTCWrapper:
                         frame: Current stack frame.
                     """
                     logging.info("Signal received, closing connection")
-                    asyncio.create_task(pc.close())
-                    asyncio.get_event_loop().stop()
+                    loop.call_soon_threadsafe(lambda: asyncio.create_task(pc.close()))
+                    loop.stop()
 
                 # Add signal handler for clean shutdown
-                loop = asyncio.get_event_loop()
                 loop.add_signal_handler(signal.SIGINT, signal_handler, signal.SIGINT, None)
 
                 # Keep the connection alive until closed
-                while pc.iceConnectionState != "closed":
-                    await asyncio.sleep(1)
+                await closed.wait()
 
         except Exception as e:
             logging.error(f"Receiver error: {e}")
         finally:
             # Clean up the connection and close the display
             await pc.close()
-            plt.close(fig)
+            if display_task:
+                # Closing the connection ends the track, so display_video finishes saving
+                # the queued frames and closes ffmpeg; give it time before returning
+                done, _ = await asyncio.wait([display_task], timeout=10)
+                if not done:
+                    logging.warning("Timed out waiting for received video to finish saving")
+                elif not display_task.cancelled() and display_task.exception():
+                    logging.error(f"Video display error: {display_task.exception()}")
+            if display:
+                display.close()
             logging.info("Receiver connection closed")
 
 """
@@ -349,11 +868,13 @@ When streaming a stored video file, the connection is automatically closed when
 video ends.
 
 ### Prerequisites
-1. **Python Version**: Python 3.7 or higher.
+1. **Python Version**: Python 3.9 or higher.
 2. **Dependencies**: Install the required Python packages using pip:
    ```bash
-   pip install aiortc websockets matplotlib opencv-python numpy
+   pip install aiortc websockets orjson opencv-python numpy
    ```
+   Optionally install `uvloop` (Linux/macOS) for a faster asyncio event loop; it is used automatically when available.
+   To save received video, `ffmpeg` must also be installed and on the `PATH`.
 3. **Camera or Video File**: Ensure a camera is connected for live streaming or provide a valid video file path (e.g., `.mp4`, `.avi`) for stored video streaming.
 4. **Operating System**: Supported on Linux, macOS, and Windows.
 
@@ -401,7 +922,7 @@ video ends.
    - If a stored video is used, the connection will automatically close when the video ends.
 
 3. **Run the Receiver**:
-   - The receiver displays the streamed video in a matplotlib window and can save it to a file.
+   - The receiver displays the streamed video in an OpenCV window and can save it to a file.
    - Run:
      ```python
      import asyncio
@@ -411,11 +932,14 @@ video ends.
          wrapper = WebRTCWrapper(save_output=True)  # Set to True to save video
          await wrapper.run_receiver()
 
-     asyncio.run(main())
+     if __name__ == "__main__":
+         asyncio.run(main())
      ```
-   - A window will pop up displaying the video stream.
+   - A window will pop up displaying the video stream. It is drawn by a separate display
+     process that re-imports the main script, which is why the `if __name__ == "__main__":`
+     guard is required.
    - Press `q` in the display window to close it manually.
-   - If `save_output=True`, the received video is saved as `received_output.avi`.
+   - If `save_output=True`, the received video is saved as `received_output.mp4`.
    - The receiver will automatically close when the sender's video ends (for stored videos).
 
 ### Running on the Same Machine
@@ -436,9 +960,9 @@ video ends.
 - **Video End Detection**: When streaming a stored video file, the sender monitors the video track's `readyState`. When the track ends (state changes from `live` to `ended`), the connection is automatically closed, and the receiver will also close its display window.
 - **Timeout**: The sender and receiver wait up to 30 seconds for SDP messages. If no connection is established, they will timeout and exit.
 - **Video Source**: The default camera is automatically selected based on the OS. For Linux, it uses `/dev/video0`; for macOS, `default:none`; for Windows, camera index `0`. Specify a video file path (e.g., `video.mp4`) for stored video streaming.
-- **Saving Video**: Set `save_output=True` in the receiver to save the video as `received_output.avi` in the current directory.
+- **Saving Video**: Set `save_output=True` in the receiver to save the video as `received_output.mp4` in the current directory.
 - **Closing the Application**:
-  - Receiver: Press `q` in the matplotlib window or send a `SIGINT` (Ctrl+C) to the terminal. The receiver also closes automatically when the sender's video ends.
+  - Receiver: Press `q` in the OpenCV window or send a `SIGINT` (Ctrl+C) to the terminal. The receiver also closes automatically when the sender's video ends.
   - Sender: For stored videos, the connection closes automatically when the video ends. For live streams, use `SIGINT` (Ctrl+C) to stop.
   - Signaling Server: Use `SIGINT` (Ctrl+C) to stop.
 - **Error Handling**: Check the console logs for errors (e.g., video file not found, camera not accessible, signaling server not reachable).